@@ -2,6 +2,8 @@ import os
 from datetime import datetime, timedelta, tzinfo
 from re import I
 from utils import *
+from retention import reclaim_snapshots
+from tracing import trace, traced, dump_trace
 import yaml
 
 LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
@@ -11,7 +13,6 @@ DATABASE_NAME_PATTERN = os.getenv('DATABASE_NAME_PATTERN', 'TAG').strip()
 SUPPORTED_ENGINES = [ 'aurora', 'aurora-mysql', 'aurora-postgresql', 'postgres', 'mysql' ]
 TARGET_KMS_KEY = os.getenv('AWS_TARGET_KMS_KEY', 'None').strip()
 TARGET_ACCOUNT = os.getenv('AWS_TARGET_ACCOUNT', '000000000000').strip()
-DEBUG_DATABASE = os.getenv('DEBUG_DATABASE', '').strip()
 
 logger = logging.getLogger()
 logger.setLevel(LOGLEVEL.upper())
@@ -29,6 +30,7 @@ logger.setLevel(LOGLEVEL.upper())
     #       take a manual snapshot
 
 
+@traced
 def lambda_handler(event, context):
     client = boto3.client('rds', region_name=SOURCE_REGION)
     instances = paginate_api_call(client, 'describe_db_instances', 'DBInstances')
@@ -49,6 +51,7 @@ def lambda_handler(event, context):
     
     process_snapshots(available_snapshots, database_names, client)
     create_snapshots(database_names, client)
+    reclaim_snapshots(client, cluster_snapshots, instance_snapshots, available_snapshots, context)
 
     then = datetime.now()    
     logger.info("Finished in %ss", (then - now).seconds)
@@ -58,15 +61,17 @@ def create_snapshots(databases, client):
         if databases[database]['snapshots'] == 0:
             logger.info("Creating snapshot for database %s", database)
             target_snapshot = database + '-DBSSR'
+            trace(database, 'create', 'no snapshot within backup interval, take a manual snapshot', target_snapshot)
             if databases[database]['type'] == 'cluster':
                 client.create_db_cluster_snapshot(DBClusterIdentifier=database, DBClusterSnapshotIdentifier=target_snapshot, Tags=TAGS_CREATED_BY)
             else:
-                client.create_db_snapshot(DBIdentifier=database, DBSnapshotIdentifier=target_snapshot, Tags=TAGS_CREATED_BY)
+                client.create_db_snapshot(DBInstanceIdentifier=database, DBSnapshotIdentifier=target_snapshot, Tags=TAGS_CREATED_BY)
 
 def process_snapshots(snapshots, databases, client):
     for snapshot in snapshots.values():
         if snapshot['action'] == 'tbd':
             logger.error("Bug Spotted! Snapshot without action: %s", yaml.dump(snapshot))
+            dump_trace(snapshot['id'])
             continue
 
         if snapshot['action'] == 'skip':
@@ -186,27 +191,21 @@ def filter_available_snapshots(pattern, response, databases, backup_interval=Non
         if backup_interval and 'SnapshotCreateTime' in snapshot and snapshot['SnapshotCreateTime'].replace(tzinfo=None) < datetime.utcnow().replace(tzinfo=None) - timedelta(hours=backup_interval):
             continue
 
-        debugger = False
-        if snapshot[identifier] == DEBUG_DATABASE:
-            debugger = True
-            if snapshot[identifier] in results: logger.info('Current Snapshot: %s', results[snapshot[identifier]]['name'])
-            logger.info('Snapshot Name: %s, Type: %s', snapshot['name'], snapshot['SnapshotType'])
-
         if snapshot[identifier] not in results:
             snapshot['action'] = 'tbd'
             results[snapshot[identifier]] = snapshot
             databases[snapshot[identifier]]['snapshots'] += 1
-            if debugger: logger.info('Entered A')
+            trace(snapshot[identifier], 'A', 'first candidate snapshot for database', snapshot['name'])
 
         if snapshot['SnapshotType'] == 'shared':
             if snapshot['name'].split(':').pop().replace('-target','') == results[snapshot[identifier]]['name']:
                 results[snapshot[identifier]]['SnapshotType'] = 'shared'
                 results[snapshot[identifier]]['action'] = 'delete'
-                if debugger: logger.info('Entered B1')
+                trace(snapshot[identifier], 'B1', 'shared copy of current snapshot found, delete it', snapshot['name'])
                 continue
             snapshot['action'] = 'skip'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered B')
+            trace(snapshot[identifier], 'B', 'shared snapshot takes over as current, skip', snapshot['name'])
             continue
 
         if results[snapshot[identifier]]['SnapshotType'] == 'shared':
@@ -214,78 +213,78 @@ def filter_available_snapshots(pattern, response, databases, backup_interval=Non
                 snapshot['SnapshotType'] = 'shared'
                 snapshot['action'] = 'delete'
                 results[snapshot[identifier]] = snapshot
-                if debugger: logger.info('Entered C1')
+                trace(snapshot[identifier], 'C1', 'origin of current shared snapshot found, delete it', snapshot['name'])
                 continue
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'skip'
-            if debugger: logger.info('Entered C')
+            trace(snapshot[identifier], 'C', 'current snapshot is shared, skip', snapshot['name'])
             continue
 
         if find_tag(results[snapshot[identifier]]['TagList'], 'DBSSR', 'shared'):
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'skip'
-            if debugger: logger.info('Entered D')
+            trace(snapshot[identifier], 'D', 'current snapshot already shared, skip', snapshot['name'])
             continue
 
         if find_tag(snapshot['TagList'], 'DBSSR', 'shared'):
             snapshot['action'] = 'skip'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered E')
+            trace(snapshot[identifier], 'E', 'snapshot already shared, skip', snapshot['name'])
             continue
 
         if 'SnapshotCreateTime' not in results[snapshot[identifier]] and results[snapshot[identifier]]['SnapshotType'] == 'manual':
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'skip'
-            if debugger: logger.info('Entered F')
+            trace(snapshot[identifier], 'F', 'current manual snapshot still being created, skip', snapshot['name'])
             continue
 
         if 'SnapshotCreateTime' not in snapshot and snapshot['SnapshotType'] == 'manual':
             snapshot['action'] = 'skip'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered G')
+            trace(snapshot[identifier], 'G', 'manual snapshot still being created, skip', snapshot['name'])
             continue
 
         if results[snapshot[identifier]]['Status'] in ['copying', 'creating']:
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'skip'
-            if debugger: logger.info('Entered H')
+            trace(snapshot[identifier], 'H', 'current snapshot is copying or creating, skip', snapshot['name'])
             continue
 
         if snapshot['Status'] == 'copying':
             snapshot['action'] = 'skip'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered I')
+            trace(snapshot[identifier], 'I', 'snapshot is copying, skip', snapshot['name'])
             continue
         
         if results[snapshot[identifier]]['SnapshotType'] == 'manual':
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'share'
-            if debugger: logger.info('Entered J')
+            trace(snapshot[identifier], 'J', 'current manual snapshot is ready, share it', snapshot['name'])
             continue
 
         if snapshot['SnapshotType'] == 'manual' and results[snapshot[identifier]]['SnapshotType'] == 'automated':
             snapshot['action'] = 'share'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered K')
+            trace(snapshot[identifier], 'K', 'manual snapshot preferred over automated, share it', snapshot['name'])
             continue
 
         if snapshot['SnapshotType'] == 'manual' and results[snapshot[identifier]]['SnapshotType'] == 'manual':
             snapshot['action'] == 'share'
             if snapshot['SnapshotCreateTime'].replace(tzinfo=None) >= results[snapshot[identifier]]['SnapshotCreateTime'].replace(tzinfo=None):
                 results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered L')
+            trace(snapshot[identifier], 'L', 'newest manual snapshot kept as current', snapshot['name'])
             continue
 
         if find_tag(results[snapshot[identifier]]['TagList'], 'DBSSR', 'copied'):
             if results[snapshot[identifier]]['action'] == 'tbd':
                 results[snapshot[identifier]]['action'] = 'skip'
-            if debugger: logger.info('Entered M')
+            trace(snapshot[identifier], 'M', 'current snapshot already copied, skip', snapshot['name'])
             continue
 
         if find_tag(snapshot['TagList'], 'DBSSR', 'copied'):
             snapshot['action'] = 'skip'
             results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered N')
+            trace(snapshot[identifier], 'N', 'snapshot already copied, skip', snapshot['name'])
             continue
 
         if snapshot['SnapshotType'] == 'automated' and results[snapshot[identifier]]['SnapshotType'] == 'automated':
@@ -293,8 +292,8 @@ def filter_available_snapshots(pattern, response, databases, backup_interval=Non
 
             if snapshot['SnapshotCreateTime'].replace(tzinfo=None) >= results[snapshot[identifier]]['SnapshotCreateTime'].replace(tzinfo=None):
                 results[snapshot[identifier]] = snapshot
-            if debugger: logger.info('Entered O')
+            trace(snapshot[identifier], 'O', 'newest automated snapshot kept for copy', snapshot['name'])
             continue
 
-        if debugger: logger.info('Entered P')
+        trace(snapshot[identifier], 'P', 'no rule matched', snapshot['name'])
     return results
@@ -2,6 +2,8 @@ import os
 from datetime import datetime, timedelta, tzinfo
 from re import I
 from utils import *
+from retention import reclaim_snapshots
+from tracing import trace, traced, dump_trace
 import yaml
 
 LOGLEVEL = os.getenv('LOG_LEVEL', 'ERROR').strip()
@@ -11,7 +13,6 @@ DATABASE_NAME_PATTERN = os.getenv('DATABASE_NAME_PATTERN', 'ALL').strip()
 SUPPORTED_ENGINES = [ 'aurora', 'aurora-mysql', 'aurora-postgresql', 'postgres', 'mysql' ]
 TARGET_KMS_KEY = os.getenv('AWS_TARGET_KMS_KEY', 'None').strip()
 SOURCE_ACCOUNT = os.getenv('AWS_SOURCE_ACCOUNT', '000000000000').strip()
-DEBUG_DATABASE = os.getenv('DEBUG_DATABASE', '').strip()
 
 logger = logging.getLogger()
 logger.setLevel(LOGLEVEL.upper())
@@ -27,6 +28,7 @@ logger.setLevel(LOGLEVEL.upper())
     #       if it is tagged 'restored' and instance creation date is greater than snapshot's, tag it 'disposable'
 
 
+@traced
 def lambda_handler(event, context):
     client = boto3.client('rds', region_name=TARGET_REGION)
     instances = paginate_api_call(client, 'describe_db_instances', 'DBInstances')
@@ -46,6 +48,7 @@ def lambda_handler(event, context):
     for snapshot in available_snapshots.values():
         logger.info("Database Created: %s, Engine: %s, Type: %s, Status: %s, Name: %s, Action: %s", snapshot.get('SnapshotCreateTime', 'creating'), snapshot['Engine'], snapshot['SnapshotType'], snapshot['Status'], snapshot['id'], snapshot['action']) 
     process_snapshots(available_snapshots, database_names, client)
+    reclaim_snapshots(client, cluster_snapshots, instance_snapshots, available_snapshots, context)
 
     then = datetime.now()    
     logger.info("Finished in %ss", (then - now).seconds)
@@ -65,66 +68,63 @@ def join_filtered_databases(clusters, instances):
 
 def define_actions(snapshots, databases):
     for snapshot in snapshots.values():
-        debugger = False
-        if snapshot['id'] == DEBUG_DATABASE:
-            debugger = True
-            logger.info("Current: %s", snapshot['arn'])
-
         if snapshot['SnapshotType'] == 'shared':
             snapshot['action'] = 'copy'
-            if debugger: logger.info('Entrou A')
+            trace(snapshot['id'], 'A', 'shared snapshot, copy it', snapshot['name'])
             continue
 
         if snapshot['SnapshotType'] == 'manual' and snapshot['Status'] == 'copying':
             snapshot['action'] = 'skip'
-            if debugger: logger.info('Entrou B')
+            trace(snapshot['id'], 'B', 'manual snapshot is copying, skip', snapshot['name'])
             continue
 
         if snapshot['SnapshotType'] == 'manual' and not find_tag(snapshot['TagList'], 'DBSSR', 'shared'):
             if snapshot['Status'] == 'creating':
                 snapshot['action'] = 'skip'
+                trace(snapshot['id'], 'C0', 'manual snapshot still being created, skip', snapshot['name'])
                 continue
             snapshot['action'] = 'share'
-            if debugger: logger.info('Entrou C')
+            trace(snapshot['id'], 'C', 'manual snapshot not yet shared, share it', snapshot['name'])
             continue
         
         database = databases[snapshot['id']]
         if database['old'] == 'available':
             snapshot['action'] = 'delete_database'
+            trace(snapshot['id'], 'I', 'previous database still available, delete it', snapshot['name'])
             continue
 
         if database['status'] == 'available':
             if database['identifier'].endswith('-dbssr'):
                 snapshot['action'] = 'restore'
-                if debugger: logger.info('Entrou D')
+                trace(snapshot['id'], 'D', 'database already renamed, restore snapshot', snapshot['name'])
                 continue
 
             if snapshot['type'] == 'cluster' and database['mode'] != 'serverless' and 'class' not in database:
                 snapshot['action'] = 'restore_cluster_instance'
-                if debugger: logger.info('Entrou E')
+                trace(snapshot['id'], 'E', 'provisioned cluster without instance, create it', snapshot['name'])
                 continue
 
             if database['create_time'] and datetime.strptime(database['create_time'], "%Y-%m-%d %H:%M:%S").replace(tzinfo=None) > datetime.utcnow().replace(tzinfo=None) - timedelta(hours=BACKUP_INTERVAL):
                 if database['snapshots'] == 2:
                     snapshot['action'] = 'skip'
-                    if debugger: logger.info('Entrou F')
+                    trace(snapshot['id'], 'F', 'database recently restored and both snapshots present, skip', snapshot['name'])
                     continue
                     
                 snapshot['action'] = 'delete_snapshot'
-                if debugger: logger.info('Entrou G')
+                trace(snapshot['id'], 'G', 'database recently restored, delete snapshot', snapshot['name'])
                 continue
 
             snapshot['action'] = 'rename'
-            if debugger: logger.info('Entrou H')
+            trace(snapshot['id'], 'H', 'database is stale, rename it', snapshot['name'])
             continue
 
         if database['status'] in ['renaming', 'creating']:
             snapshot['action'] = 'skip'
-            if debugger: logger.info('Entrou J')
+            trace(snapshot['id'], 'J', 'database is renaming or creating, skip', snapshot['name'])
             continue
 
         snapshot['action'] = 'tbd'
-        if debugger: logger.info('Entrou K')
+        trace(snapshot['id'], 'K', 'no rule matched', snapshot['name'])
 
     return snapshots
 
@@ -132,6 +132,7 @@ def process_snapshots(snapshots, databases, client):
     for snapshot in snapshots.values():
         if snapshot['action'] == 'tbd':
             logger.error("############## Bug Spotted! Snapshot without action: %s", yaml.dump(snapshot))
+            dump_trace(snapshot['id'])
             continue
 
         if snapshot['action'] == 'skip':
@@ -205,8 +206,11 @@ def process_snapshots(snapshots, databases, client):
                 if snapshot['type'] == 'cluster':
                     if database['mode'] != 'serverless':
                         logger.info("deleting instance %s from cluster %s", database_name.replace('-cluster','').replace('-dbssr',''), database_name)
-                        client.delete_db_instance(DBInstanceIdentifier=database_name.replace('-cluster','').replace('-dbssr',''), SkipFinalSnapshot=True)
-                        time.sleep(5)
+                        try:
+                            client.delete_db_instance(DBInstanceIdentifier=database_name.replace('-cluster','').replace('-dbssr',''), SkipFinalSnapshot=True)
+                            time.sleep(5)
+                        except Exception as e:
+                            logger.info("Cluster instance probably already deleted: %s", e)
                     client.delete_db_cluster(DBClusterIdentifier=database_name, SkipFinalSnapshot=True)
                 else:
                     logger.info("deleting standalone instance %s", database_name)
@@ -319,13 +323,15 @@ def filter_available_snapshots(pattern, response, databases, backup_interval=Non
         # Signal the existence of a shared and manual snapshot
         if snapshot['name'].replace('-target','') == results[snapshot[identifier]]['name'].split(':').pop() or snapshot['name'].split(':').pop() == results[snapshot[identifier]]['name'].replace('-target',''):
         # if not snapshot['SnapshotType'] == results[snapshot[identifier]]['SnapshotType']:
-            print('Current: ', results[snapshot[identifier]]['name'], ':', results[snapshot[identifier]]['SnapshotType'], 'iterator:', snapshot['name'], ':', snapshot['SnapshotType'])
+            trace(snapshot[identifier], 'pair', 'shared and manual counterparts found', snapshot['name'])
             databases[snapshot[identifier]]['snapshots'] += 1
 
         if 'SnapshotCreateTime' in snapshot and snapshot['SnapshotCreateTime'].replace(tzinfo=None) >= results[snapshot[identifier]]['SnapshotCreateTime'].replace(tzinfo=None):
             results[snapshot[identifier]] = snapshot
+            trace(snapshot[identifier], 'newest', 'snapshot is at least as recent as current, becomes current', snapshot['name'])
             continue
 
         results[snapshot[identifier]] = snapshot
+        trace(snapshot[identifier], 'last', 'last listed snapshot becomes current', snapshot['name'])
 
     return results
@@ -0,0 +1,122 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from utils import *
+
+BACKUP_INTERVAL = int(os.getenv('BACKUP_INTERVAL', '24'))
+RETENTION_KEEP_LAST = int(os.getenv('RETENTION_KEEP_LAST', '2'))
+RETENTION_MAX_AGE = int(os.getenv('RETENTION_MAX_AGE', str(BACKUP_INTERVAL)))
+RETENTION_CONCURRENCY = int(os.getenv('RETENTION_CONCURRENCY', '4'))
+RETENTION_DELETE_RATE = float(os.getenv('RETENTION_DELETE_RATE', '5'))
+RETENTION_MAX_DELETES = int(os.getenv('RETENTION_MAX_DELETES', '100'))
+RETENTION_TIME_MARGIN = int(os.getenv('RETENTION_TIME_MARGIN', '10'))
+
+    # RETENTION
+    # 1. gather every manual snapshot tagged CreatedBy=DBSSR, grouped by database
+    # 2. keep the newest RETENTION_KEEP_LAST ones and any younger than RETENTION_MAX_AGE hours
+    #       RETENTION_MAX_AGE is never shorter than BACKUP_INTERVAL, as the handlers still act on
+    #       -DBSSR and -target snapshots within the backup window
+    # 3. keep whatever the current run has picked as the database's snapshot
+    # 4. delete the oldest RETENTION_MAX_DELETES of the rest concurrently, at most RETENTION_DELETE_RATE calls per second
+    #       stop once less than RETENTION_TIME_MARGIN seconds of the invocation remain
+    #       anything not deleted is deferred to the next run
+    # 5. report how much allocated storage was reclaimed, separately for instances and clusters
+    #       Aurora cluster snapshots report a nominal AllocatedStorage, not their actual size
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def reclaim_snapshots(client, cluster_snapshots, instance_snapshots, current_snapshots=None, context=None, keep_last=RETENTION_KEEP_LAST, max_age=RETENTION_MAX_AGE, max_deletes=RETENTION_MAX_DELETES):
+    keep = set(snapshot['name'] for snapshot in (current_snapshots or {}).values())
+    max_age = max(max_age, BACKUP_INTERVAL)
+    expired = {
+        **filter_expired_snapshots(cluster_snapshots, keep, keep_last, max_age),
+        **filter_expired_snapshots(instance_snapshots, keep, keep_last, max_age)
+    }
+    logger.info("Found %i expired DBSSR snapshot(s)", len(expired))
+    report = { 'deleted': 0, 'failed': 0, 'deferred': 0, 'reclaimed': { 'instance': 0, 'cluster': 0 } }
+    if not expired:
+        return report
+
+    candidates = sorted(expired.values(), key=lambda snapshot: snapshot['created'])
+    report['deferred'] = max(0, len(candidates) - max_deletes)
+    limiter = RateLimiter(RETENTION_DELETE_RATE)
+    with ThreadPoolExecutor(max_workers=max(1, RETENTION_CONCURRENCY)) as executor:
+        futures = { executor.submit(delete_snapshot, client, snapshot, limiter, context): snapshot for snapshot in candidates[:max_deletes] }
+        for future in as_completed(futures):
+            snapshot = futures[future]
+            try:
+                deleted = future.result()
+            except Exception as e:
+                logger.error("Could not delete expired snapshot %s: %s", snapshot['name'], e)
+                report['failed'] += 1
+                continue
+            if not deleted:
+                report['deferred'] += 1
+                continue
+            report['deleted'] += 1
+            report['reclaimed'][snapshot['type']] += snapshot['storage']
+
+    if report['deferred']:
+        logger.info("Deferred %i expired snapshot(s) to the next run", report['deferred'])
+    logger.info("Deleted %i expired snapshot(s), %i failed, reclaimed %i GiB of instance storage and %i GiB of nominal cluster storage (Aurora snapshots do not report their actual size)", report['deleted'], report['failed'], report['reclaimed']['instance'], report['reclaimed']['cluster'])
+    return report
+
+def delete_snapshot(client, snapshot, limiter, context=None):
+    limiter.wait()
+    if context and context.get_remaining_time_in_millis() < RETENTION_TIME_MARGIN * 1000:
+        return False
+    logger.info("Deleting expired snapshot %s", snapshot['name'])
+    if snapshot['type'] == 'cluster':
+        client.delete_db_cluster_snapshot(DBClusterSnapshotIdentifier=snapshot['name'])
+    else:
+        client.delete_db_snapshot(DBSnapshotIdentifier=snapshot['name'])
+    return True
+
+def filter_expired_snapshots(response, keep, keep_last, max_age):
+    results = {}
+    snapshots = 'DBSnapshots'
+    identifier = 'DBInstanceIdentifier'
+    snapshot_identifier = 'DBSnapshotIdentifier'
+    snapshot_type = 'instance'
+    if 'DBClusterSnapshots' in response:
+        snapshots = 'DBClusterSnapshots'
+        identifier = 'DBClusterIdentifier'
+        snapshot_identifier = 'DBClusterSnapshotIdentifier'
+        snapshot_type = 'cluster'
+
+    databases = {}
+    for snapshot in response[snapshots]:
+        # Only our own manual snapshots can be deleted
+        if snapshot['SnapshotType'] != 'manual' or not find_tag(snapshot.get('TagList', []), 'CreatedBy', 'DBSSR'):
+            continue
+
+        # Ignore snapshots still in progress
+        if snapshot['Status'] != 'available' or 'SnapshotCreateTime' not in snapshot:
+            continue
+
+        databases.setdefault(snapshot[identifier], []).append(snapshot)
+
+    oldest = datetime.utcnow().replace(tzinfo=None) - timedelta(hours=max_age)
+    for database in databases.values():
+        database.sort(key=lambda snapshot: snapshot['SnapshotCreateTime'].replace(tzinfo=None), reverse=True)
+        for snapshot in database[keep_last:]:
+            if snapshot[snapshot_identifier] in keep or snapshot['SnapshotCreateTime'].replace(tzinfo=None) >= oldest:
+                continue
+            results[snapshot[snapshot_identifier]] = { 'name': snapshot[snapshot_identifier], 'type': snapshot_type, 'storage': snapshot.get('AllocatedStorage', 0), 'created': snapshot['SnapshotCreateTime'].replace(tzinfo=None) }
+
+    return results
@@ -0,0 +1,704 @@
+import argparse
+import heapq
+import random
+import threading
+import types
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+import copy_or_take_snapshots
+import restore_snapshots
+import retention
+from utils import *
+
+SOURCE_ACCOUNT = '111111111111'
+TARGET_ACCOUNT = '222222222222'
+REGION = 'us-east-1'
+PAGE_SIZE = 100
+DURATIONS = {
+    'snapshot': 600,
+    'copy': 900,
+    'delete_snapshot': 30,
+    'rename': 120,
+    'restore': 1200,
+    'create_instance': 900,
+    'delete_database': 600
+}
+
+    # SIMULATOR
+    # 1. build a fake source and target account sharing a virtual clock
+    # 2. every tick, run transitions that are due, then the source and target handlers
+    #       each API call costs virtual latency and may be throttled (retried like botocore does)
+    #       every thread keeps its own virtual time, so calls from the retention pool overlap
+    #       an invocation running past the Lambda timeout is aborted
+    # 3. optionally seed stale DBSSR-tagged and untagged manual snapshots for retention to sort out
+    # 4. stop once every target database has been restored and its old copy deleted,
+    #       or keep ticking for a number of virtual days after that
+    # 5. report ticks, virtual time, API calls, retention results and real time taken
+    #       untagged snapshots must survive the whole run
+
+
+class LambdaTimeout(BaseException):
+    # Not an Exception, so the handlers' own except clauses cannot swallow it
+    pass
+
+
+class FakeCloud:
+    def __init__(self, start, latency=0.1, jitter=0.05, throttle=0.0, rate=0, max_attempts=5, durations=None, seed=0):
+        self.now = start
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle = throttle
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.durations = { **DURATIONS, **(durations or {}) }
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.events = []
+        self.sequence = 0
+        self.deadline = None
+        self.accounts = {}
+        self.calls = {}
+        self.throttled = 0
+        self.window = {}
+        self.local = threading.local()
+
+    def account(self, account_id):
+        if account_id not in self.accounts:
+            self.accounts[account_id] = FakeAccount(self, account_id)
+        return self.accounts[account_id]
+
+    def clock(self):
+        return getattr(self.local, 'now', None) or self.now
+
+    def set_clock(self, when):
+        if getattr(self.local, 'now', None) is not None:
+            self.local.now = when
+        self.advance(when)
+
+    def schedule(self, delay, transition):
+        with self.lock:
+            self.sequence += 1
+            heapq.heappush(self.events, (self.clock() + timedelta(seconds=delay), self.sequence, transition))
+
+    def advance(self, until):
+        with self.lock:
+            while self.events and self.events[0][0] <= until:
+                when, sequence, transition = heapq.heappop(self.events)
+                self.now = max(self.now, when)
+                transition()
+            self.now = max(self.now, until)
+
+    def sleep(self, seconds):
+        self.set_clock(self.clock() + timedelta(seconds=seconds))
+
+    def request(self, account_id, operation):
+        for attempt in range(1, self.max_attempts + 1):
+            started = self.clock()
+            if self.deadline and started > self.deadline:
+                raise LambdaTimeout("Invocation exceeded its timeout during %s" % operation)
+            with self.lock:
+                self.calls[operation] = self.calls.get(operation, 0) + 1
+                latency = max(0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+                throttled = self.is_throttled(account_id, started)
+                self.throttled += throttled
+            self.set_clock(started + timedelta(seconds=latency))
+            if not throttled:
+                return
+            if attempt < self.max_attempts:
+                self.sleep(min(20, 2 ** attempt * self.random.random()))
+
+        raise ClientError({ 'Error': { 'Code': 'Throttling', 'Message': 'Rate exceeded' } }, operation)
+
+    def is_throttled(self, account_id, started):
+        second = int(started.timestamp())
+        window = self.window.get(account_id)
+        window = (second, window[1] + 1) if window and window[0] == second else (second, 1)
+        self.window[account_id] = window
+        if self.rate and window[1] > self.rate:
+            return True
+        return self.random.random() < self.throttle
+
+
+class FakeAccount:
+    def __init__(self, cloud, account_id):
+        self.cloud = cloud
+        self.id = account_id
+        self.instances = {}
+        self.clusters = {}
+        self.snapshots = {}
+        self.cluster_snapshots = {}
+        self.arns = {}
+
+    def arn(self, resource, identifier):
+        return 'arn:aws:rds:%s:%s:%s:%s' % (REGION, self.id, resource, identifier)
+
+    def utcnow(self):
+        return self.cloud.clock().replace(tzinfo=timezone.utc)
+
+    def add_instance(self, identifier, engine, tags, status='available', cluster=None, instance_class='db.t3.medium', storage=20):
+        instance = {
+            'DBInstanceIdentifier': identifier,
+            'DBInstanceArn': self.arn('db', identifier),
+            'DBInstanceStatus': status,
+            'DBInstanceClass': instance_class,
+            'Engine': engine,
+            'AllocatedStorage': storage,
+            'DBSubnetGroup': { 'DBSubnetGroupName': 'default' },
+            'VpcSecurityGroups': [ { 'VpcSecurityGroupId': 'sg-00000000', 'Status': 'active' } ],
+            'TagList': list(tags)
+        }
+        if status == 'available':
+            instance['InstanceCreateTime'] = self.utcnow()
+        if cluster:
+            instance['DBClusterIdentifier'] = cluster
+            self.clusters[cluster]['DBClusterMembers'].append({ 'DBInstanceIdentifier': identifier, 'IsClusterWriter': True })
+        self.instances[identifier] = instance
+        self.arns[instance['DBInstanceArn']] = instance
+        return instance
+
+    def add_cluster(self, identifier, engine, tags, mode='provisioned', status='available', storage=20):
+        cluster = {
+            'DBClusterIdentifier': identifier,
+            'DBClusterArn': self.arn('cluster', identifier),
+            'Status': status,
+            'Engine': engine,
+            'EngineMode': mode,
+            'AllocatedStorage': storage,
+            'DBSubnetGroup': 'default',
+            'VpcSecurityGroups': [ { 'VpcSecurityGroupId': 'sg-00000000', 'Status': 'active' } ],
+            'DBClusterMembers': [],
+            'TagList': list(tags)
+        }
+        if status == 'available':
+            cluster['ClusterCreateTime'] = self.utcnow()
+        self.clusters[identifier] = cluster
+        self.arns[cluster['DBClusterArn']] = cluster
+        return cluster
+
+    def add_snapshot(self, kind, database, name, snapshot_type, tags, status='creating', source=None):
+        snapshot = {
+            'SnapshotType': snapshot_type,
+            'Status': status,
+            'Engine': database['Engine'],
+            'AllocatedStorage': database['AllocatedStorage'],
+            'TagList': list(tags or []),
+            '_shared_with': []
+        }
+        if kind == 'cluster':
+            snapshot.update({ 'DBClusterSnapshotIdentifier': name, 'DBClusterIdentifier': database['DBClusterIdentifier'], 'DBClusterSnapshotArn': self.arn('cluster-snapshot', name), 'EngineMode': database['EngineMode'] })
+            self.cluster_snapshots[name] = snapshot
+            self.arns[snapshot['DBClusterSnapshotArn']] = snapshot
+        else:
+            snapshot.update({ 'DBSnapshotIdentifier': name, 'DBInstanceIdentifier': database['DBInstanceIdentifier'], 'DBSnapshotArn': self.arn('snapshot', name) })
+            self.snapshots[name] = snapshot
+            self.arns[snapshot['DBSnapshotArn']] = snapshot
+        if source and 'SnapshotCreateTime' in source:
+            snapshot['SnapshotCreateTime'] = source['SnapshotCreateTime']
+        if status == 'available':
+            snapshot.setdefault('SnapshotCreateTime', self.utcnow())
+        return snapshot
+
+    def complete_snapshot(self, snapshot):
+        snapshot['Status'] = 'available'
+        snapshot.setdefault('SnapshotCreateTime', self.utcnow())
+
+    def take_automated_snapshots(self):
+        stamp = self.cloud.now.strftime('%Y-%m-%d-%H-%M')
+        for instance in self.instances.values():
+            if 'DBClusterIdentifier' not in instance and instance['DBInstanceStatus'] == 'available':
+                snapshot = self.add_snapshot('instance', instance, 'rds:%s-%s' % (instance['DBInstanceIdentifier'], stamp), 'automated', [])
+                self.cloud.schedule(self.cloud.durations['snapshot'], lambda snapshot=snapshot: self.complete_snapshot(snapshot))
+        for cluster in self.clusters.values():
+            if cluster['Status'] == 'available':
+                snapshot = self.add_snapshot('cluster', cluster, 'rds:%s-%s' % (cluster['DBClusterIdentifier'], stamp), 'automated', [])
+                self.cloud.schedule(self.cloud.durations['snapshot'], lambda snapshot=snapshot: self.complete_snapshot(snapshot))
+
+    def find_snapshot(self, collection, identifier):
+        if identifier in collection:
+            return collection[identifier]
+        for account in self.cloud.accounts.values():
+            snapshot = account.arns.get(identifier)
+            if snapshot is not None and (account is self or self.id in snapshot.get('_shared_with', [])):
+                return snapshot
+        return None
+
+    def remove(self, collection, identifier, arn):
+        collection.pop(identifier, None)
+        self.arns.pop(arn, None)
+
+
+class FakePaginator:
+    def __init__(self, client, operation):
+        self.client = client
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        key, items = self.client.describe(self.operation, **kwargs)
+        for page in range(0, max(len(items), 1), PAGE_SIZE):
+            self.client.cloud.request(self.client.account.id, self.operation)
+            yield { key: items[page:page + PAGE_SIZE] }
+
+
+def api(method):
+    def wrapper(self, **kwargs):
+        self.cloud.request(self.account.id, method.__name__)
+        with self.cloud.lock:
+            return method(self, **kwargs)
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+def fail(code, message, operation):
+    raise ClientError({ 'Error': { 'Code': code, 'Message': message } }, operation)
+
+def public(record):
+    result = { key: value for key, value in record.items() if not key.startswith('_') }
+    result['TagList'] = list(record.get('TagList', []))
+    return result
+
+
+class FakeRdsClient:
+    def __init__(self, cloud, account):
+        self.cloud = cloud
+        self.account = account
+
+    def get_paginator(self, operation):
+        return FakePaginator(self, operation)
+
+    def describe(self, operation, IncludeShared=False):
+        with self.cloud.lock:
+            if operation == 'describe_db_instances':
+                return 'DBInstances', [ public(record) for identifier, record in sorted(self.account.instances.items()) ]
+            if operation == 'describe_db_clusters':
+                return 'DBClusters', [ public(record) for identifier, record in sorted(self.account.clusters.items()) ]
+            if operation == 'describe_db_snapshots':
+                return 'DBSnapshots', self.describe_snapshots('snapshots', 'DBSnapshotIdentifier', 'DBSnapshotArn', IncludeShared)
+            if operation == 'describe_db_cluster_snapshots':
+                return 'DBClusterSnapshots', self.describe_snapshots('cluster_snapshots', 'DBClusterSnapshotIdentifier', 'DBClusterSnapshotArn', IncludeShared)
+        fail('InvalidAction', 'Operation %s is not supported by the simulator' % operation, operation)
+
+    def describe_snapshots(self, collection, identifier, arn, include_shared):
+        results = [ public(record) for record in getattr(self.account, collection).values() ]
+        if include_shared:
+            for account in self.cloud.accounts.values():
+                if account is self.account:
+                    continue
+                for record in getattr(account, collection).values():
+                    if self.account.id in record['_shared_with']:
+                        shared = public(record)
+                        shared.update({ identifier: record[arn], 'SnapshotType': 'shared', 'TagList': [] })
+                        results.append(shared)
+        return sorted(results, key=lambda record: record[identifier])
+
+    @api
+    def add_tags_to_resource(self, ResourceName, Tags):
+        resource = self.account.arns.get(ResourceName)
+        if resource is None:
+            fail('InvalidParameterValue', 'Unknown resource %s' % ResourceName, 'AddTagsToResource')
+        keys = [ tag['Key'] for tag in Tags ]
+        resource['TagList'] = [ tag for tag in resource['TagList'] if tag['Key'] not in keys ] + list(Tags)
+
+    @api
+    def create_db_snapshot(self, DBInstanceIdentifier, DBSnapshotIdentifier, Tags=None):
+        instance = self.account.instances.get(DBInstanceIdentifier)
+        if instance is None:
+            fail('DBInstanceNotFound', DBInstanceIdentifier, 'CreateDBSnapshot')
+        self.create_snapshot('instance', instance, instance['DBInstanceStatus'], self.account.snapshots, DBSnapshotIdentifier, Tags, 'CreateDBSnapshot')
+
+    @api
+    def create_db_cluster_snapshot(self, DBClusterIdentifier, DBClusterSnapshotIdentifier, Tags=None):
+        cluster = self.account.clusters.get(DBClusterIdentifier)
+        if cluster is None:
+            fail('DBClusterNotFoundFault', DBClusterIdentifier, 'CreateDBClusterSnapshot')
+        self.create_snapshot('cluster', cluster, cluster['Status'], self.account.cluster_snapshots, DBClusterSnapshotIdentifier, Tags, 'CreateDBClusterSnapshot')
+
+    def create_snapshot(self, kind, database, status, collection, name, tags, operation):
+        if status != 'available':
+            fail('InvalidDBInstanceState', 'Database is %s' % status, operation)
+        if name in collection:
+            fail('DBSnapshotAlreadyExists', name, operation)
+        snapshot = self.account.add_snapshot(kind, database, name, 'manual', tags)
+        self.cloud.schedule(self.cloud.durations['snapshot'], lambda: self.account.complete_snapshot(snapshot))
+
+    @api
+    def copy_db_snapshot(self, SourceDBSnapshotIdentifier, TargetDBSnapshotIdentifier, KmsKeyId=None, Tags=None):
+        self.copy_snapshot('instance', self.account.snapshots, SourceDBSnapshotIdentifier, TargetDBSnapshotIdentifier, Tags, 'CopyDBSnapshot')
+
+    @api
+    def copy_db_cluster_snapshot(self, SourceDBClusterSnapshotIdentifier, TargetDBClusterSnapshotIdentifier, KmsKeyId=None, Tags=None):
+        self.copy_snapshot('cluster', self.account.cluster_snapshots, SourceDBClusterSnapshotIdentifier, TargetDBClusterSnapshotIdentifier, Tags, 'CopyDBClusterSnapshot')
+
+    def copy_snapshot(self, kind, collection, source_name, name, tags, operation):
+        source = self.account.find_snapshot(collection, source_name)
+        if source is None:
+            fail('DBSnapshotNotFound', source_name, operation)
+        if source['Status'] != 'available':
+            fail('InvalidDBSnapshotState', 'Snapshot is %s' % source['Status'], operation)
+        if name in collection:
+            fail('DBSnapshotAlreadyExists', name, operation)
+        database = { 'Engine': source['Engine'], 'AllocatedStorage': source['AllocatedStorage'], 'DBInstanceIdentifier': source.get('DBInstanceIdentifier'), 'DBClusterIdentifier': source.get('DBClusterIdentifier'), 'EngineMode': source.get('EngineMode') }
+        snapshot = self.account.add_snapshot(kind, database, name, 'manual', tags, status='copying', source=source)
+        self.cloud.schedule(self.cloud.durations['copy'], lambda: self.account.complete_snapshot(snapshot))
+
+    @api
+    def modify_db_snapshot_attribute(self, DBSnapshotIdentifier, AttributeName, ValuesToAdd=None, ValuesToRemove=None):
+        self.share_snapshot(self.account.snapshots, DBSnapshotIdentifier, ValuesToAdd, ValuesToRemove, 'ModifyDBSnapshotAttribute')
+
+    @api
+    def modify_db_cluster_snapshot_attribute(self, DBClusterSnapshotIdentifier, AttributeName, ValuesToAdd=None, ValuesToRemove=None):
+        self.share_snapshot(self.account.cluster_snapshots, DBClusterSnapshotIdentifier, ValuesToAdd, ValuesToRemove, 'ModifyDBClusterSnapshotAttribute')
+
+    def share_snapshot(self, collection, name, add, remove, operation):
+        snapshot = collection.get(name)
+        if snapshot is None:
+            fail('DBSnapshotNotFound', name, operation)
+        if snapshot['SnapshotType'] != 'manual':
+            fail('InvalidDBSnapshotState', 'Only manual snapshots can be shared', operation)
+        shared_with = [ account for account in snapshot['_shared_with'] if account not in (remove or []) ]
+        snapshot['_shared_with'] = shared_with + [ account for account in (add or []) if account not in shared_with ]
+
+    @api
+    def delete_db_snapshot(self, DBSnapshotIdentifier):
+        self.delete_snapshot(self.account.snapshots, DBSnapshotIdentifier, 'DBSnapshotArn', 'DeleteDBSnapshot')
+
+    @api
+    def delete_db_cluster_snapshot(self, DBClusterSnapshotIdentifier):
+        self.delete_snapshot(self.account.cluster_snapshots, DBClusterSnapshotIdentifier, 'DBClusterSnapshotArn', 'DeleteDBClusterSnapshot')
+
+    def delete_snapshot(self, collection, name, arn, operation):
+        snapshot = collection.get(name)
+        if snapshot is None:
+            fail('DBSnapshotNotFound', name, operation)
+        if snapshot['Status'] != 'available':
+            fail('InvalidDBSnapshotState', 'Snapshot is %s' % snapshot['Status'], operation)
+        snapshot['Status'] = 'deleting'
+        self.cloud.schedule(self.cloud.durations['delete_snapshot'], lambda: self.account.remove(collection, name, snapshot[arn]))
+
+    @api
+    def modify_db_instance(self, DBInstanceIdentifier, NewDBInstanceIdentifier=None, ApplyImmediately=False):
+        instance = self.account.instances.get(DBInstanceIdentifier)
+        if instance is None:
+            fail('DBInstanceNotFound', DBInstanceIdentifier, 'ModifyDBInstance')
+        if instance['DBInstanceStatus'] != 'available':
+            fail('InvalidDBInstanceState', 'Instance is %s' % instance['DBInstanceStatus'], 'ModifyDBInstance')
+        if NewDBInstanceIdentifier in self.account.instances:
+            fail('DBInstanceAlreadyExists', NewDBInstanceIdentifier, 'ModifyDBInstance')
+        self.account.remove(self.account.instances, DBInstanceIdentifier, instance['DBInstanceArn'])
+        instance.update({ 'DBInstanceIdentifier': NewDBInstanceIdentifier, 'DBInstanceArn': self.account.arn('db', NewDBInstanceIdentifier), 'DBInstanceStatus': 'renaming' })
+        self.account.instances[NewDBInstanceIdentifier] = instance
+        self.account.arns[instance['DBInstanceArn']] = instance
+        if 'DBClusterIdentifier' in instance:
+            for member in self.account.clusters[instance['DBClusterIdentifier']]['DBClusterMembers']:
+                if member['DBInstanceIdentifier'] == DBInstanceIdentifier:
+                    member['DBInstanceIdentifier'] = NewDBInstanceIdentifier
+        self.cloud.schedule(self.cloud.durations['rename'], lambda: instance.update({ 'DBInstanceStatus': 'available' }))
+
+    @api
+    def modify_db_cluster(self, DBClusterIdentifier, NewDBClusterIdentifier=None, ApplyImmediately=False):
+        cluster = self.account.clusters.get(DBClusterIdentifier)
+        if cluster is None:
+            fail('DBClusterNotFoundFault', DBClusterIdentifier, 'ModifyDBCluster')
+        if cluster['Status'] != 'available':
+            fail('InvalidDBClusterStateFault', 'Cluster is %s' % cluster['Status'], 'ModifyDBCluster')
+        if NewDBClusterIdentifier in self.account.clusters:
+            fail('DBClusterAlreadyExistsFault', NewDBClusterIdentifier, 'ModifyDBCluster')
+        self.account.remove(self.account.clusters, DBClusterIdentifier, cluster['DBClusterArn'])
+        cluster.update({ 'DBClusterIdentifier': NewDBClusterIdentifier, 'DBClusterArn': self.account.arn('cluster', NewDBClusterIdentifier), 'Status': 'renaming' })
+        self.account.clusters[NewDBClusterIdentifier] = cluster
+        self.account.arns[cluster['DBClusterArn']] = cluster
+        for member in cluster['DBClusterMembers']:
+            self.account.instances[member['DBInstanceIdentifier']]['DBClusterIdentifier'] = NewDBClusterIdentifier
+        self.cloud.schedule(self.cloud.durations['rename'], lambda: cluster.update({ 'Status': 'available' }))
+
+    @api
+    def restore_db_instance_from_db_snapshot(self, DBSnapshotIdentifier, DBInstanceIdentifier, Engine=None, Tags=None, DBInstanceClass=None, DBSubnetGroupName=None, VpcSecurityGroupIds=None):
+        snapshot = self.account.find_snapshot(self.account.snapshots, DBSnapshotIdentifier)
+        if snapshot is None:
+            fail('DBSnapshotNotFound', DBSnapshotIdentifier, 'RestoreDBInstanceFromDBSnapshot')
+        if snapshot['Status'] != 'available':
+            fail('InvalidDBSnapshotState', 'Snapshot is %s' % snapshot['Status'], 'RestoreDBInstanceFromDBSnapshot')
+        if DBInstanceIdentifier in self.account.instances:
+            fail('DBInstanceAlreadyExists', DBInstanceIdentifier, 'RestoreDBInstanceFromDBSnapshot')
+        instance = self.account.add_instance(DBInstanceIdentifier, Engine or snapshot['Engine'], Tags or [], status='creating', instance_class=DBInstanceClass or 'db.t3.medium', storage=snapshot['AllocatedStorage'])
+        self.cloud.schedule(self.cloud.durations['restore'], lambda: instance.update({ 'DBInstanceStatus': 'available', 'InstanceCreateTime': self.account.utcnow() }))
+
+    @api
+    def restore_db_cluster_from_snapshot(self, SnapshotIdentifier, DBClusterIdentifier, Engine, Tags=None, DBSubnetGroupName=None, VpcSecurityGroupIds=None, EngineMode=None):
+        snapshot = self.account.find_snapshot(self.account.cluster_snapshots, SnapshotIdentifier)
+        if snapshot is None:
+            fail('DBClusterSnapshotNotFoundFault', SnapshotIdentifier, 'RestoreDBClusterFromSnapshot')
+        if snapshot['Status'] != 'available':
+            fail('InvalidDBClusterSnapshotStateFault', 'Snapshot is %s' % snapshot['Status'], 'RestoreDBClusterFromSnapshot')
+        if DBClusterIdentifier in self.account.clusters:
+            fail('DBClusterAlreadyExistsFault', DBClusterIdentifier, 'RestoreDBClusterFromSnapshot')
+        cluster = self.account.add_cluster(DBClusterIdentifier, Engine, Tags or [], mode=EngineMode or snapshot['EngineMode'], status='creating', storage=snapshot['AllocatedStorage'])
+        self.cloud.schedule(self.cloud.durations['restore'], lambda: cluster.update({ 'Status': 'available', 'ClusterCreateTime': self.account.utcnow() }))
+
+    @api
+    def create_db_instance(self, DBInstanceIdentifier, DBInstanceClass, Engine, DBClusterIdentifier=None, Tags=None):
+        if DBInstanceIdentifier in self.account.instances:
+            fail('DBInstanceAlreadyExists', DBInstanceIdentifier, 'CreateDBInstance')
+        if DBClusterIdentifier and DBClusterIdentifier not in self.account.clusters:
+            fail('DBClusterNotFoundFault', DBClusterIdentifier, 'CreateDBInstance')
+        instance = self.account.add_instance(DBInstanceIdentifier, Engine, Tags or [], status='creating', cluster=DBClusterIdentifier, instance_class=DBInstanceClass)
+        self.cloud.schedule(self.cloud.durations['create_instance'], lambda: instance.update({ 'DBInstanceStatus': 'available', 'InstanceCreateTime': self.account.utcnow() }))
+
+    @api
+    def delete_db_instance(self, DBInstanceIdentifier, SkipFinalSnapshot=False):
+        instance = self.account.instances.get(DBInstanceIdentifier)
+        if instance is None:
+            fail('DBInstanceNotFound', DBInstanceIdentifier, 'DeleteDBInstance')
+        if instance['DBInstanceStatus'] != 'available':
+            fail('InvalidDBInstanceState', 'Instance is %s' % instance['DBInstanceStatus'], 'DeleteDBInstance')
+        instance['DBInstanceStatus'] = 'deleting'
+        self.cloud.schedule(self.cloud.durations['delete_database'], lambda: self.drop_instance(instance))
+
+    def drop_instance(self, instance):
+        self.account.remove(self.account.instances, instance['DBInstanceIdentifier'], instance['DBInstanceArn'])
+        cluster = self.account.clusters.get(instance.get('DBClusterIdentifier'))
+        if cluster:
+            cluster['DBClusterMembers'] = [ member for member in cluster['DBClusterMembers'] if member['DBInstanceIdentifier'] != instance['DBInstanceIdentifier'] ]
+
+    @api
+    def delete_db_cluster(self, DBClusterIdentifier, SkipFinalSnapshot=False):
+        cluster = self.account.clusters.get(DBClusterIdentifier)
+        if cluster is None:
+            fail('DBClusterNotFoundFault', DBClusterIdentifier, 'DeleteDBCluster')
+        if cluster['Status'] != 'available' or cluster['DBClusterMembers']:
+            fail('InvalidDBClusterStateFault', 'Cluster is %s with %i instance(s)' % (cluster['Status'], len(cluster['DBClusterMembers'])), 'DeleteDBCluster')
+        cluster['Status'] = 'deleting'
+        self.cloud.schedule(self.cloud.durations['delete_database'], lambda: self.account.remove(self.account.clusters, DBClusterIdentifier, cluster['DBClusterArn']))
+
+
+def build_fleet(cloud, instances=1, clusters=0, serverless=0):
+    source = cloud.account(SOURCE_ACCOUNT)
+    target = cloud.account(TARGET_ACCOUNT)
+    source_tags = [ { 'Key': 'DBSSRSource', 'Value': 'true' } ]
+    fleet = []
+    for index in range(instances):
+        name = 'db%i' % index
+        engine = 'mysql' if index % 2 else 'postgres'
+        source.add_instance(name, engine, source_tags)
+        target.add_instance('tgt-' + name, engine, [ { 'Key': 'DBSSR', 'Value': name } ])
+        fleet.append(('instance', name, 'tgt-' + name))
+    for index in range(clusters):
+        name = 'cdb%i-cluster' % index
+        source.add_cluster(name, 'aurora-mysql', source_tags)
+        target.add_cluster('tgt-' + name, 'aurora-mysql', [ { 'Key': 'DBSSR', 'Value': name } ])
+        target.add_instance('tgt-cdb%i' % index, 'aurora-mysql', [ { 'Key': 'DBSSR', 'Value': name } ], cluster='tgt-' + name)
+        fleet.append(('cluster', name, 'tgt-' + name))
+    for index in range(serverless):
+        name = 'sls%i-cluster' % index
+        source.add_cluster(name, 'aurora-postgresql', source_tags, mode='serverless')
+        target.add_cluster('tgt-' + name, 'aurora-postgresql', [ { 'Key': 'DBSSR', 'Value': name } ], mode='serverless')
+        fleet.append(('serverless', name, 'tgt-' + name))
+    return fleet
+
+def seed_leftovers(cloud, fleet, leftovers, now):
+    source = cloud.account(SOURCE_ACCOUNT)
+    target = cloud.account(TARGET_ACCOUNT)
+    tags = [ { 'Key': 'CreatedBy', 'Value': 'DBSSR' } ]
+    untagged = []
+    for kind, name, identifier in fleet:
+        snapshot_kind = 'instance' if kind == 'instance' else 'cluster'
+        database = source.instances[name] if kind == 'instance' else source.clusters[name]
+        for index in range(leftovers):
+            created = (now - timedelta(days=2, hours=index)).replace(tzinfo=timezone.utc)
+            seeded = [
+                (source, '%s-stale-%03i-DBSSR' % (name, index), tags),
+                (target, '%s-stale-%03i-DBSSR-target' % (name, index), tags),
+                (source, '%s-manual-%03i' % (name, index), []),
+                (target, '%s-manual-%03i' % (name, index), [])
+            ]
+            for account, snapshot_name, snapshot_tags in seeded:
+                snapshot = account.add_snapshot(snapshot_kind, database, snapshot_name, 'manual', snapshot_tags, status='available')
+                snapshot['SnapshotCreateTime'] = created
+                if not snapshot_tags:
+                    untagged.append((account, snapshot_kind, snapshot_name))
+    return untagged
+
+def count_stale(cloud):
+    return sum(1 for account in cloud.accounts.values() for collection in [account.snapshots, account.cluster_snapshots] for name in collection if '-stale-' in name)
+
+def is_refreshed(target, kind, identifier):
+    if kind == 'instance':
+        database = target.instances.get(identifier)
+        status = database and database['DBInstanceStatus']
+        old = target.instances
+    else:
+        database = target.clusters.get(identifier)
+        status = database and database['Status']
+        old = target.clusters
+    if status != 'available' or not find_tag(database['TagList'], 'DBSSRCreateTime') or identifier + '-dbssr' in old:
+        return False
+    if kind == 'cluster':
+        return any(target.instances[member['DBInstanceIdentifier']]['DBInstanceStatus'] == 'available' for member in database['DBClusterMembers'])
+    return True
+
+def virtual_datetime(cloud):
+    class VirtualDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cloud.clock()
+
+        @classmethod
+        def utcnow(cls):
+            return cloud.clock()
+    return VirtualDatetime
+
+def virtual_time(cloud, start):
+    class VirtualTime:
+        @staticmethod
+        def sleep(seconds):
+            cloud.sleep(seconds)
+
+        @staticmethod
+        def monotonic():
+            return (cloud.clock() - start).total_seconds()
+    return VirtualTime
+
+def virtual_executor(cloud):
+    class VirtualThreadPoolExecutor(ThreadPoolExecutor):
+        # Each task starts on the earliest free virtual worker, whichever real thread runs it
+        def __init__(self, max_workers=None, *args, **kwargs):
+            super().__init__(max_workers, *args, **kwargs)
+            # Pin the submitting thread's clock so every task is submitted at the same virtual time
+            self.pinned = getattr(cloud.local, 'now', None) is None
+            cloud.local.now = cloud.clock()
+            self.workers = [ cloud.clock() ] * self._max_workers
+            self.workers_lock = threading.Lock()
+
+        def shutdown(self, *args, **kwargs):
+            super().shutdown(*args, **kwargs)
+            if self.pinned:
+                cloud.local.now = None
+
+        def submit(self, fn, *args, **kwargs):
+            submitted = cloud.clock()
+            def run():
+                with self.workers_lock:
+                    cloud.local.now = max(submitted, heapq.heappop(self.workers))
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    with self.workers_lock:
+                        heapq.heappush(self.workers, cloud.local.now)
+                    cloud.local.now = None
+            return super().submit(run)
+    return VirtualThreadPoolExecutor
+
+@contextmanager
+def patched(patches):
+    originals = [ (module, name, getattr(module, name)) for module, name, value in patches ]
+    for module, name, value in patches:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
+
+def invoke(cloud, handler, timeout):
+    cloud.deadline = cloud.now + timedelta(seconds=timeout)
+    context = types.SimpleNamespace(get_remaining_time_in_millis=lambda: max(0, int((cloud.deadline - cloud.clock()).total_seconds() * 1000)))
+    try:
+        handler({}, context)
+        return None
+    except LambdaTimeout:
+        return 'timeout'
+    except Exception as e:
+        logger.info("Invocation failed: %s", e)
+        return 'failure'
+    finally:
+        cloud.deadline = None
+
+def simulate(instances=1, clusters=0, serverless=0, interval=300, max_ticks=2000, timeout=60, backup_hour=3, leftovers=0, days=0, **options):
+    start = datetime(2026, 1, 1, backup_hour, 0)
+    cloud = FakeCloud(start - timedelta(hours=1), **options)
+    fleet = build_fleet(cloud, instances, clusters, serverless)
+    untagged = seed_leftovers(cloud, fleet, leftovers, start)
+    source = cloud.account(SOURCE_ACCOUNT)
+    target = cloud.account(TARGET_ACCOUNT)
+
+    def daily_backup():
+        source.take_automated_snapshots()
+        cloud.schedule(86400, daily_backup)
+    cloud.schedule(0, daily_backup)
+    cloud.advance(start)
+
+    clock = virtual_datetime(cloud)
+    sleeper = virtual_time(cloud, start)
+    patches = [
+        (copy_or_take_snapshots, 'boto3', types.SimpleNamespace(client=lambda *args, **kwargs: FakeRdsClient(cloud, source))),
+        (restore_snapshots, 'boto3', types.SimpleNamespace(client=lambda *args, **kwargs: FakeRdsClient(cloud, target))),
+        (copy_or_take_snapshots, 'TARGET_ACCOUNT', TARGET_ACCOUNT),
+        (copy_or_take_snapshots, 'DATABASE_NAME_PATTERN', 'TAG'),
+        (restore_snapshots, 'SOURCE_ACCOUNT', SOURCE_ACCOUNT),
+        (restore_snapshots, 'DATABASE_NAME_PATTERN', 'ALL'),
+        (restore_snapshots, 'time', sleeper),
+        (retention, 'time', sleeper),
+        (retention, 'ThreadPoolExecutor', virtual_executor(cloud))
+    ]
+    patches += [ (module, 'datetime', clock) for module in [copy_or_take_snapshots, restore_snapshots, retention] ]
+
+    reclaimed = { 'deleted': 0, 'deferred': 0, 'failed': 0 }
+    def reclaim_snapshots(*args, **kwargs):
+        result = retention.reclaim_snapshots(*args, **kwargs)
+        for key in reclaimed:
+            reclaimed[key] += result[key]
+        return result
+    patches += [ (module, 'reclaim_snapshots', reclaim_snapshots) for module in [copy_or_take_snapshots, restore_snapshots] ]
+
+    report = { 'databases': len(fleet), 'ticks': None, 'converged_after': None, 'failures': 0, 'timeouts': 0 }
+    converged = None
+    wall = time.perf_counter()
+    with patched(patches):
+        for tick in range(1, max_ticks + 1):
+            cloud.advance(start + timedelta(seconds=interval * tick))
+            for handler in [copy_or_take_snapshots.lambda_handler, restore_snapshots.lambda_handler]:
+                outcome = invoke(cloud, handler, timeout)
+                if outcome == 'timeout':
+                    report['timeouts'] += 1
+                elif outcome == 'failure':
+                    report['failures'] += 1
+            if converged is None and all(is_refreshed(target, kind, identifier) for kind, name, identifier in fleet):
+                converged = cloud.now
+                report['ticks'] = tick
+                report['converged_after'] = str(cloud.now - start)
+            if converged and cloud.now >= converged + timedelta(days=days):
+                break
+
+    report['wall_seconds'] = round(time.perf_counter() - wall, 3)
+    report['api_calls'] = sum(cloud.calls.values())
+    report['throttled'] = cloud.throttled
+    report['retention'] = { **reclaimed, 'stale_remaining': count_stale(cloud) }
+    missing = [ name for account, kind, name in untagged if name not in (account.snapshots if kind == 'instance' else account.cluster_snapshots) ]
+    report['untagged_kept'] = '%i/%i' % (len(untagged) - len(missing), len(untagged))
+    report['calls'] = dict(sorted(cloud.calls.items()))
+    if missing:
+        raise AssertionError("Untagged snapshots were deleted: %s" % ', '.join(missing))
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run both handlers tick by tick against an in-process fake RDS.')
+    parser.add_argument('--instances', type=int, default=1)
+    parser.add_argument('--clusters', type=int, default=0)
+    parser.add_argument('--serverless', type=int, default=0)
+    parser.add_argument('--interval', type=int, default=300, help='seconds of virtual time between invocations')
+    parser.add_argument('--max-ticks', type=int, default=2000)
+    parser.add_argument('--timeout', type=int, default=60, help='Lambda timeout in virtual seconds')
+    parser.add_argument('--latency', type=float, default=0.1, help='mean API latency in virtual seconds')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--throttle', type=float, default=0.0, help='probability of a call being throttled')
+    parser.add_argument('--rate', type=int, default=0, help='calls per virtual second before throttling, 0 disables')
+    parser.add_argument('--max-attempts', type=int, default=5)
+    parser.add_argument('--leftovers', type=int, default=0, help='stale tagged and untagged manual snapshots to seed per database and account')
+    parser.add_argument('--days', type=float, default=0, help='virtual days to keep ticking after convergence')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='CRITICAL')
+    args = vars(parser.parse_args())
+    logger.setLevel(args.pop('log_level').upper())
+    print(yaml.dump(simulate(**args), default_flow_style=False, sort_keys=False))
@@ -0,0 +1,82 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import tracemalloc
+from collections import defaultdict, deque
+from utils import *
+
+TRACE_SIZE = int(os.getenv('TRACE_SIZE', '50'))
+TRACE = os.getenv('TRACE', 'false').strip().lower() == 'true'
+PROFILE = os.getenv('PROFILE', '').strip().lower()
+PROFILE_TOP = int(os.getenv('PROFILE_TOP', '20'))
+DEBUG_DATABASE = os.getenv('DEBUG_DATABASE', '').strip()
+
+    # TRACING
+    # 1. every decision appends a (rule, reason, snapshot) tuple to its database's ring buffer
+    #       each buffer keeps the last TRACE_SIZE records, so busy databases cannot evict quiet ones
+    # 2. buffers are only formatted and logged on error or when requested
+    #       via the TRACE environment variable or a {"trace": true} event
+    # 3. PROFILE=cpu|memory|all wraps the run in cProfile and/or tracemalloc and logs the top PROFILE_TOP hot spots
+    #       profiles are dumped before the trace so they never measure the dump itself
+
+_decisions = defaultdict(lambda: deque(maxlen=TRACE_SIZE))
+
+
+def trace(database, rule, reason, snapshot=None):
+    _decisions[database].append((rule, reason, snapshot))
+
+def dump_trace(database=DEBUG_DATABASE):
+    databases = [database] if database else list(_decisions)
+    records = [ (name, record) for name in databases for record in _decisions.get(name, []) ]
+    logger.error("Decision trace (%i record(s)):", len(records))
+    for name, record in records:
+        logger.error("Database: %s, Rule: %s, Snapshot: %s, Reason: %s", name, record[0], record[2], record[1])
+
+def traced(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        _decisions.clear()
+        profiler = None
+        profiling_memory = PROFILE in ['memory', 'all']
+        started_tracemalloc = profiling_memory and not tracemalloc.is_tracing()
+        failed = False
+        if PROFILE in ['cpu', 'all']:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if started_tracemalloc:
+            tracemalloc.start()
+
+        try:
+            result = handler(event, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if profiler:
+                profiler.disable()
+            if profiling_memory:
+                dump_memory_profile()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            if profiler:
+                dump_cpu_profile(profiler)
+            if failed:
+                dump_trace()
+
+        if TRACE or (isinstance(event, dict) and event.get('trace')):
+            dump_trace()
+        return result
+    return wrapper
+
+def dump_cpu_profile(profiler):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    logger.error("CPU profile:\n%s", output.getvalue())
+
+def dump_memory_profile():
+    current, peak = tracemalloc.get_traced_memory()
+    logger.error("Memory profile: current %i KiB, peak %i KiB", current // 1024, peak // 1024)
+    for stat in tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP]:
+        logger.error("%s", stat)